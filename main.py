@@ -1,9 +1,15 @@
 import sounddevice as sd
+import scipy.fft
 import scipy.io.wavfile as wav
+import soundfile as sf
 import librosa
 import numpy as np
+import json
 import os
 import time
+from numpy.lib.stride_tricks import sliding_window_view
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 # ==============================
 # CONFIG
@@ -11,9 +17,16 @@ import time
 SAMPLE_RATE = 16000
 RECORD_SECONDS = 3
 FIXED_LEN = SAMPLE_RATE * 1  # 1 second
+N_MFCC = 20
+N_MELS = 128
+N_FFT = 512
+HOP_LENGTH = 160
 
 COMMAND_DIR = "commands"
 OWNER_DIR = "owner"
+FEAT_SUFFIX = ".mfcc.npy"
+REF_FEATURES = "features.npy"
+REF_LABELS = "labels.json"
 
 os.makedirs(COMMAND_DIR, exist_ok=True)
 os.makedirs(OWNER_DIR, exist_ok=True)
@@ -31,21 +44,63 @@ def record_voice(filename):
     )
     sd.wait()
 
-    audio = audio.flatten()
+    # Peak-normalize to 0.9 and scale to int16 in a single in-place pass.
+    audio = audio.ravel()
     peak = np.max(np.abs(audio))
-    if peak > 0:
-        audio = audio / peak * 0.9
+    scale = 0.9 * 32767 / peak if peak > 0 else 32767
+    np.multiply(audio, scale, out=audio)
 
-    wav.write(filename, SAMPLE_RATE, np.int16(audio * 32767))
+    pcm = audio.astype(np.int16)
+    wav.write(filename, SAMPLE_RATE, pcm)
     print(f"Saved: {filename}")
 
+    # Same samples load_audio would decode from the file.
+    return pcm / np.float32(32768)
+
 # ==============================
-# PREPROCESS AUDIO
+# LOAD AUDIO
+# ==============================
+def load_audio(file):
+    # Recordings are written at SAMPLE_RATE, so soundfile can decode
+    # them directly; librosa is only needed to resample foreign files.
+    y, sr = sf.read(file, dtype="float32", always_2d=False)
+    if sr != SAMPLE_RATE:
+        return librosa.load(file, sr=SAMPLE_RATE, mono=True)
+
+    if y.ndim == 2:
+        y = y.mean(axis=1)
+
+    return y, sr
+
+# ==============================
+# TRIM SILENCE
 # ==============================
-def preprocess_audio(file):
-    y, sr = librosa.load(file, sr=SAMPLE_RATE, mono=True)
+# Same frames and threshold as librosa.effects.trim (centered RMS,
+# -top_db below the loudest frame) without the dB conversion.
+def fast_trim(y, top_db=35, frame=2048, hop=512):
+    padded = np.pad(y, frame // 2)
+    w = sliding_window_view(padded, frame)[::hop]
+    rms = np.sqrt(np.einsum("ij,ij->i", w, w) / frame)
+    rms = np.maximum(rms, 1e-5)
 
-    y, _ = librosa.effects.trim(y, top_db=35)
+    thr = rms.max() * 10 ** (-top_db / 20)
+    nz = np.flatnonzero(rms > thr)
+    if len(nz) == 0:
+        return y[:0]
+
+    return y[nz[0] * hop : min(len(y), (nz[-1] + 1) * hop)]
+
+# ==============================
+# PREPROCESS AUDIO
+# ==============================
+# source is a WAV path or a signal already decoded at SAMPLE_RATE.
+def preprocess_audio(source):
+    if isinstance(source, np.ndarray):
+        y, sr = source, SAMPLE_RATE
+    else:
+        y, sr = load_audio(source)
+
+    y = fast_trim(y, top_db=35)
     y = librosa.util.fix_length(y, size=FIXED_LEN)
 
     rms = np.sqrt(np.mean(y ** 2))
@@ -54,37 +109,127 @@ def preprocess_audio(file):
 
     return y, sr
 
+# ==============================
+# MFCC
+# ==============================
+# Same result as librosa.feature.mfcc with our settings, but the mel
+# filterbank is built once instead of on every call.
+_MEL_BASIS = librosa.filters.mel(sr=SAMPLE_RATE, n_fft=N_FFT, n_mels=N_MELS)
+
+def compute_mfcc(y):
+    S = np.abs(librosa.stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH)) ** 2
+    mel = _MEL_BASIS @ S
+    log_mel = librosa.power_to_db(mel)
+    return scipy.fft.dct(log_mel, axis=0, type=2, norm="ortho")[:N_MFCC]
+
 # ==============================
 # FEATURE EXTRACTION
 # ==============================
-def extract_features(file):
-    y, sr = preprocess_audio(file)
+def compute_features(source):
+    y, _ = preprocess_audio(source)
 
-    mfcc = librosa.feature.mfcc(
-        y=y,
-        sr=sr,
-        n_mfcc=20,
-        n_fft=512,
-        hop_length=160
-    )
+    mfcc = compute_mfcc(y)
 
     delta = librosa.feature.delta(mfcc)
     delta2 = librosa.feature.delta(mfcc, order=2)
 
-    feat = np.concatenate([
-        np.mean(mfcc, axis=1),
-        np.std(mfcc, axis=1),
-        np.mean(delta, axis=1),
-        np.std(delta, axis=1),
-        np.mean(delta2, axis=1),
-        np.std(delta2, axis=1)
-    ])
+    # mean/std of mfcc, delta and delta2 are reduced straight into
+    # their slots of the feature vector instead of concatenating.
+    feat = np.empty(6 * N_MFCC, dtype=np.float32)
+    stats = feat.reshape(3, 2, N_MFCC)
+    for i, m in enumerate((mfcc, delta, delta2)):
+        np.mean(m, axis=1, out=stats[i, 0])
+        np.std(m, axis=1, out=stats[i, 1])
+
+    feat /= np.linalg.norm(feat) + 1e-8
+    return feat
+
+# ==============================
+# FEATURE CACHE
+# ==============================
+# Keyed on mtime_ns so a re-recorded file is a new entry; the bound
+# keeps repeated test.wav recordings from growing the cache forever.
+@lru_cache(maxsize=256)
+def _cached_features(path, mtime_ns):
+    feat = compute_features(path)
+    feat.setflags(write=False)  # shared between callers
+    return feat
+
+def extract_features(source):
+    if isinstance(source, np.ndarray):
+        return compute_features(source)
+    return _cached_features(source, os.stat(source).st_mtime_ns)
+
+def load_features(path):
+    # Reference features are persisted next to the WAV and only
+    # regenerated when the recording is newer than its sidecar.
+    sidecar = path + FEAT_SUFFIX
+    if (os.path.exists(sidecar)
+            and os.path.getmtime(sidecar) >= os.path.getmtime(path)):
+        return np.load(sidecar, mmap_mode="r")
+
+    feat = extract_features(path)
+    save_features(path, feat)
+    return feat
+
+def save_features(path, feat):
+    np.save(path + FEAT_SUFFIX, feat)
+
+def prune_sidecars(dirpath):
+    # Drop cached features whose recording has been deleted.
+    for entry in os.scandir(dirpath):
+        if entry.name.endswith(FEAT_SUFFIX):
+            wav_path = entry.path[:-len(FEAT_SUFFIX)]
+            if not os.path.exists(wav_path):
+                os.remove(entry.path)
+
+def load_all_features(paths):
+    # librosa's decode and FFT work happens in C with the GIL released,
+    # so cold references extract in parallel across cores.
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+        return list(ex.map(load_features, paths))
+
+def list_wavs(dirpath):
+    return [
+        os.path.join(dirpath, file)
+        for file in sorted(os.listdir(dirpath))
+        if file.endswith(".wav")
+    ]
 
-    return feat / (np.linalg.norm(feat) + 1e-8)
+# ==============================
+# REFERENCE CACHE
+# ==============================
+def build_reference_cache(dirpath):
+    # One contiguous (N, D) float32 matrix per directory plus the
+    # matching file names, rebuilt only when the recordings change.
+    prune_sidecars(dirpath)
+    paths = list_wavs(dirpath)
+    labels = [os.path.basename(path) for path in paths]
+    if not paths:
+        return np.empty((0, 0), dtype=np.float32), labels
+
+    feat_path = os.path.join(dirpath, REF_FEATURES)
+    label_path = os.path.join(dirpath, REF_LABELS)
+
+    if os.path.exists(feat_path) and os.path.exists(label_path):
+        newest = max(os.path.getmtime(path) for path in paths)
+        with open(label_path) as f:
+            cached_labels = json.load(f)
+        if cached_labels == labels and os.path.getmtime(feat_path) >= newest:
+            return np.load(feat_path, mmap_mode="r"), labels
+
+    feats = np.stack(load_all_features(paths)).astype(np.float32)
+    np.save(feat_path, feats, allow_pickle=False)
+    with open(label_path, "w") as f:
+        json.dump(labels, f)
+
+    return feats, labels
 
 # ==============================
 # COSINE DISTANCE
 # ==============================
+# f1 may be a single vector or an (N, D) matrix of
+# references, in which case all N distances come back at once.
 def cosine_distance(f1, f2):
     return 1.0 - np.dot(f1, f2)
 
@@ -98,33 +243,30 @@ def distance_to_similarity(d):
 # BUILD COMMAND MODELS
 # ==============================
 def build_command_models():
-    models = {}
+    groups = {}
+    feats, labels = build_reference_cache(COMMAND_DIR)
 
-    for file in os.listdir(COMMAND_DIR):
-        cmd = file.split("_")[0]
-        path = os.path.join(COMMAND_DIR, file)
-        feat = extract_features(path)
-        models.setdefault(cmd, []).append(feat)
+    for label, feat in zip(labels, feats):
+        cmd = label.split("_")[0]
+        groups.setdefault(cmd, []).append(feat)
 
-    for cmd in models:
-        models[cmd] = np.mean(models[cmd], axis=0)
+    cmds = [cmd.upper() for cmd in groups]
+    centroids = np.stack(
+        [np.mean(feats, axis=0) for feats in groups.values()]
+    ).astype(np.float32)
 
-    return models
+    return cmds, centroids
 
 # ==============================
 # COMMAND DETECTION
 # ==============================
-def detect_command(input_file, models, threshold=0.45):
-    input_feat = extract_features(input_file)
+def detect_command(input_feat, models, threshold=0.45):
+    labels, centroids = models
 
-    best_cmd = None
-    best_dist = float("inf")
-
-    for cmd, centroid in models.items():
-        dist = cosine_distance(input_feat, centroid)
-        if dist < best_dist:
-            best_dist = dist
-            best_cmd = cmd.upper()
+    dists = cosine_distance(centroids, input_feat)
+    best = int(np.argmin(dists))
+    best_cmd = labels[best]
+    best_dist = dists[best]
 
     sim = distance_to_similarity(best_dist)
     print(f"Command={best_cmd} | similarity={sim:.1f}% | distance={best_dist:.3f}")
@@ -138,28 +280,24 @@ def detect_command(input_file, models, threshold=0.45):
 # BUILD OWNER MODEL
 # ==============================
 def build_owner_model():
-    feats = []
-
-    for file in os.listdir(OWNER_DIR):
-        path = os.path.join(OWNER_DIR, file)
-        feats.append(extract_features(path))
+    feats, _ = build_reference_cache(OWNER_DIR)
 
     if len(feats) == 0:
         raise RuntimeError("No owner samples found")
 
     centroid = np.mean(feats, axis=0)
-    return centroid, feats
+
+    # The owner spread only depends on the enrolled samples, so it is
+    # computed once here rather than on every verification.
+    spread = float(np.mean(cosine_distance(feats, centroid)))
+    return centroid, spread
 
 # ==============================
 # SPEAKER VERIFICATION
 # ==============================
-def verify_speaker(input_file, owner_centroid, owner_feats, margin=0.08):
-    input_feat = extract_features(input_file)
-
+def verify_speaker(input_feat, owner_centroid, owner_spread, margin=0.08):
     d_owner = cosine_distance(input_feat, owner_centroid)
-    intra = [cosine_distance(owner_centroid, f) for f in owner_feats]
-
-    threshold = np.mean(intra) + margin
+    threshold = owner_spread + margin
 
     sim = distance_to_similarity(d_owner)
     req_sim = distance_to_similarity(threshold)
@@ -192,7 +330,8 @@ def main():
                 filename = os.path.join(
                     COMMAND_DIR, f"{name}_{int(time.time())}.wav"
                 )
-                record_voice(filename)
+                audio = record_voice(filename)
+                save_features(filename, extract_features(audio))
 
         elif choice == "2":
             while True:
@@ -202,25 +341,26 @@ def main():
                 filename = os.path.join(
                     OWNER_DIR, f"{name}_{int(time.time())}.wav"
                 )
-                record_voice(filename)
+                audio = record_voice(filename)
+                save_features(filename, extract_features(audio))
 
         elif choice == "3":
-            if not os.listdir(COMMAND_DIR) or not os.listdir(OWNER_DIR):
+            if not list_wavs(COMMAND_DIR) or not list_wavs(OWNER_DIR):
                 print("❌ Please record command and owner samples first.")
                 continue
 
             cmd_models = build_command_models()
-            owner_centroid, owner_feats = build_owner_model()
+            owner_centroid, owner_spread = build_owner_model()
 
             print("Speak now...")
-            record_voice("test.wav")
+            test_feat = extract_features(record_voice("test.wav"))
 
-            cmd = detect_command("test.wav", cmd_models)
+            cmd = detect_command(test_feat, cmd_models)
             if cmd is None:
                 print("❌ Command rejected")
                 continue
 
-            if verify_speaker("test.wav", owner_centroid, owner_feats):
+            if verify_speaker(test_feat, owner_centroid, owner_spread):
                 print(f"✅ ACCESS GRANTED → {cmd}")
             else:
                 print("❌ SPEAKER REJECTED")